@@ -1,23 +1,31 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import configparser
+import filecmp
+import hashlib
+import http.client
+import json
 import os
 import pprint
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
-import urllib.request
+import traceback
 
 from collections import OrderedDict
 from packaging import version
 
 import jinja2
 import github
+import pygit2
 
 
 MAX_ATTEMPTS = 3
 GIT_MODE=os.environ.get('GIT_MODE', "git+ssh")
+MAX_JOBS=int(os.environ.get('MAX_JOBS', 8))
 
 
 def subprocess_check_call(*args, **kw):
@@ -60,8 +68,15 @@ def github_repo(g, module_data):
             slug = 'litex-hub/'+module_data['repo']
             repo = g.get_repo(slug)
             if g.token:
-                print("Updating repo ", slug)
-                repo.edit(**github_repo_config(module_data))
+                # get_repo() already returned the current settings, only
+                # send an edit when one of them differs.
+                config = github_repo_config(module_data)
+                changed = {k: v for k, v in config.items() if getattr(repo, k) != v}
+                if not changed:
+                    print("Repo up to date", slug)
+                    return True
+                print("Updating repo ", slug, sorted(changed))
+                repo.edit(**config)
             return True
         except github.UnknownObjectException as e:
             print(e)
@@ -79,16 +94,26 @@ def download(module_data):
         else:
             clone_cmd = "git clone {} {}"
 
-        cmd = clone_cmd.format(module_data['repo_url'], out_path)
+        cmd = clone_cmd.format(module_data['repo_url'], out_path).split()
 
-        subprocess_check_call(cmd.split())
+        # Borrow objects already present in the local source mirror so
+        # the upstream data is not downloaded a second time. A partial
+        # mirror can not be used, it is missing most of the blobs.
+        src_local = module_data.get('src_local', None)
+        if src_local and not is_partial_clone({'GIT_DIR': src_local}):
+            cmd[2:2] = ['--reference-if-able', src_local, '--dissociate']
+
+        subprocess_check_call(cmd)
     else:
         dotgit = os.path.join(out_path, '.git')
         assert os.path.exists(dotgit), dotgit
-        subprocess_check_call(["git", "fetch"], cwd=out_path)
-        subprocess_check_call(["git", "reset", "--hard", "origin/master"], cwd=out_path)
+        subprocess_check_call(["git", "fetch", "origin", "master"], cwd=out_path)
+        subprocess_check_call(["git", "reset", "--hard", "FETCH_HEAD"], cwd=out_path)
 
 
+# Optional 'v' prefix, then everything up to the first '-g' (the
+# `git describe` hash suffix).
+_TAG_RE = re.compile(r'^v?(?P<core>.*?)(?:-g.*)?$')
 def parse_tags(d, ignored=False):
     """
     >>> r = parse_tags('''\\
@@ -124,12 +149,7 @@ def parse_tags(d, ignored=False):
     tags = []
     itags = []
     for t in d.splitlines():
-        nt = t.strip()
-        if nt.startswith('v'):
-            nt = t[1:]
-        dashg = nt.find('-g')
-        if dashg != -1:
-            nt = nt[:dashg]
+        nt = _TAG_RE.match(t.strip()).group('core')
         try:
             v = version.parse(nt)
         except version.InvalidVersion:
@@ -146,21 +166,49 @@ def parse_tags(d, ignored=False):
     return list(tags)
 
 
-def get_hash(ref, env={}):
-    return subprocess.check_output(
-        ['git', 'rev-parse', ref],
-        env=env).decode('utf-8').strip()
+def git_repo(env={}):
+    return pygit2.Repository(env.get('GIT_DIR', '.'))
 
 
-def get_tags(env):
+def is_partial_clone(env={}):
+    return 'remote.origin.promisor' in git_repo(env).config
+
+
+def fetch_missing_blobs(ref, env={}):
+    """Download the blobs in the tree of ref which a partial clone lacks.
+
+    All of them are requested from the promisor remote in a single fetch.
+    """
     d = subprocess.check_output(
-        ['git', 'tag', '--list'],
+        ['git', 'rev-list', '--objects', '--no-walk', '--missing=print', ref],
         env=env).decode('utf-8')
+    missing = [l[1:] for l in d.splitlines() if l.startswith('?')]
+    if not missing:
+        return
+    print("Fetching {} missing objects for {}".format(len(missing), ref))
+    sys.stdout.flush()
+    subprocess.run(
+        ['git', 'fetch', '--no-tags', '--no-write-fetch-head',
+         '--recurse-submodules=no', '--stdin', 'origin'],
+        input="\n".join(missing).encode('utf-8'),
+        env=env, check=True)
+
+
+def get_hash(ref, env={}):
+    return str(git_repo(env).revparse_single(ref).id)
+
+
+def get_tags(env):
+    hashes = {}
+    refs = git_repo(env).references
+    for name in refs:
+        if name.startswith('refs/tags/'):
+            hashes[name[len('refs/tags/'):]] = str(refs[name].target)
 
     tags = OrderedDict()
-    pt, ignored = parse_tags(d, ignored=True)
+    pt, ignored = parse_tags("\n".join(hashes), ignored=True)
     for v, t in pt:
-        tags[t] = (v, get_hash(t, env))
+        tags[t] = (v, hashes[t])
     return tags, ignored
 
 
@@ -186,33 +234,30 @@ def get_src(module_data):
     src_dir = os.path.join("srcs", module_data['repo'])
     env = dict(**os.environ)
     env['GIT_DIR'] = src_dir
+    # Rewriting the history needs every blob, so those modules use a
+    # full mirror instead of a partial clone.
+    history = module_data.getboolean('history')
+    if history and os.path.exists(src_dir) and is_partial_clone(env):
+        shutil.rmtree(src_dir)
     if os.path.exists(src_dir):
+        # Single fetch session for both branches and tags.
         subprocess_check_call(
-            ['git', 'fetch', '--all'],
+            ['git', 'fetch', '--all', '--tags', '--force'],
             env=env)
     else:
-        subprocess_check_call(
-            ['git', 'clone', '--bare', '--mirror', module_data['src'], src_dir])
-    subprocess_check_call(
-        ['git', 'fetch', '--tags'],
-        env=env)
+        cmd = ['git', 'clone', '--bare', '--mirror']
+        if not history:
+            cmd.append('--filter=blob:none')
+        subprocess_check_call(cmd+[module_data['src'], src_dir])
 
     tags, ignored = get_tags(env)
     if 'v0.0' not in tags:
         # Add a default tag
-        p = subprocess.Popen(
-            ['git', 'log', '--reverse', '--pretty=%H %s'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            env=env,
-        )
-        for l in p.stdout:
-            l = l.decode('utf-8').strip()
-            if not l:
-                continue
-            break
-        p.stdout.close()
-        first_hash, desc = l.split(" ", 1)
+        # Root commits are listed newest first, the last one is the
+        # first commit `git log --reverse` would show.
+        first_hash = subprocess.check_output(
+            ['git', 'rev-list', '--max-parents=0', 'HEAD'],
+            env=env).decode('utf-8').split()[-1]
         cmd = [
             'git', 'tag', '-a',
             '-m','Dummy version on first commit so git-describe works',
@@ -227,10 +272,18 @@ def get_src(module_data):
     pprint.pprint(list(tags.items()))
     print("Ignored tags:")
     pprint.pprint(ignored)
+    refs = git_repo(env).references
     for t, v in ignored:
-        subprocess.check_call(['git', 'tag', '--delete', t], env=env)
+        print("Deleted tag '{}'".format(t))
+        refs.delete('refs/tags/'+t)
 
     git_hash = get_hash(module_data['branch'], env)
+    # The mirror is a partial clone, only the blobs of the commit being
+    # imported are needed.
+    fetch_missing_blobs(git_hash, env)
+    # The `git log` output ends up verbatim in the generated package
+    # (data_git_msg), so it is produced by git itself rather than
+    # reformatted from the raw commit object.
     git_msg = subprocess.check_output(
         ['git', 'log', '-1', git_hash], env=env).decode('utf-8')
 
@@ -243,13 +296,55 @@ def get_src(module_data):
     module_data['git_msg'] = git_msg
 
 
+_jinja_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.abspath("templates")),
+    auto_reload=False,
+    cache_size=-1,
+)
 def render(module_data, in_file, out_file):
-    template = jinja2.Template(open(in_file).read())
-    s = template.render(**module_data)
-    if s and not s.endswith('\n'):
-        s += '\n'
+    # Compiled templates are cached by the environment and reused for
+    # every module.
+    template_dir = _jinja_env.loader.searchpath[0]
+    name = os.path.relpath(os.path.abspath(in_file), template_dir)
+    template = _jinja_env.get_template(name.replace(os.path.sep, '/'))
+    # Stream the output to disk rather than building it in memory.
+    last = ''
     with open(out_file, 'w') as of:
-        of.write(s)
+        for s in template.generate(**module_data):
+            if s:
+                of.write(s)
+                last = s
+        if last and not last.endswith('\n'):
+            of.write('\n')
+
+
+def render_key(module_data, in_file):
+    """Hash of everything a rendered template depends on."""
+    h = hashlib.sha256()
+    with open(in_file, 'rb') as f:
+        h.update(f.read())
+    h.update(repr(sorted(module_data.items())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def render_cached(cache, module_data, in_file, out_file):
+    """Render a template unless out_file is already up to date.
+
+    The cache maps each output file to the render key and the size /
+    mtime the file had after it was written, so a file changed by
+    anything else (such as `git reset`) is rendered again.
+    """
+    key = render_key(module_data, in_file)
+    try:
+        st = os.stat(out_file)
+        if cache.get(out_file) == [key, st.st_size, st.st_mtime_ns]:
+            return False
+    except FileNotFoundError:
+        pass
+    render(module_data, in_file, out_file)
+    st = os.stat(out_file)
+    cache[out_file] = [key, st.st_size, st.st_mtime_ns]
+    return True
 
 
 def os_path_split_all(x):
@@ -284,6 +379,19 @@ def os_path_split_all(x):
     return bits
 
 
+def repo_path_bit(module_data, b):
+    """
+    >>> repo_path_bit({'a': 'c'}, 'b')
+    'b'
+    >>> repo_path_bit({'a': 'c'}, '__a__')
+    'c'
+    """
+    if not b.endswith('__'):
+        return b
+    assert b.startswith('__'), b
+    return module_data[b[2:-2]]
+
+
 def repo_path(module_data, path, template_dir=os.path.abspath("templates")):
     """
     >>> repo_path({'repo': 'r'}, 't/a', 't')
@@ -295,44 +403,122 @@ def repo_path(module_data, path, template_dir=os.path.abspath("templates")):
     """
     template_path = os.path.normpath(os.path.relpath(path, template_dir))
 
-    repo_bits = []
-    template_bits = os_path_split_all(template_path)
-    for b in template_bits:
-        if not b.endswith('__'):
-            repo_bits.append(b)
-            continue
-        assert b.startswith('__'), b
-        d = b[2:-2]
-        repo_bits.append(module_data[b[2:-2]])
+    repo_bits = [repo_path_bit(module_data, b) for b in os_path_split_all(template_path)]
 
     repo_dir = os.path.join('repos', module_data['repo'])
     return os.path.normpath(os.path.join(repo_dir, *repo_bits))
 
 
-def git_add_file(module_data, f):
+def git_add_files(module_data, files, batch_size=2000):
     repo_dir = os.path.abspath(os.path.join('repos', module_data['repo']))
-    cmd = ['git', 'add', os.path.relpath(f, repo_dir)]
     dotgit = os.path.join(repo_dir, '.git')
     assert os.path.exists(dotgit), dotgit
-    subprocess_check_call(cmd, cwd=repo_dir)
+    paths = [os.path.relpath(f, repo_dir) for f in files]
+    # One `git add` per batch rather than per file, while keeping the
+    # command line well below the argument length limit.
+    for i in range(0, len(paths), batch_size):
+        cmd = ['git', 'add', '--'] + paths[i:i+batch_size]
+        subprocess_check_call(cmd, cwd=repo_dir)
+
+
+HISTORY_REF = 'refs/pythondata/history'
+def filter_history(module_data):
+    """Rewrite the upstream history so all files are under the data dir.
+
+    The result is kept in a bare repository next to the source mirror
+    and only rewritten again when the commit or directory changes.
+    """
+    src_local = module_data['src_local']
+    filtered = src_local+'.history'
+    env = dict(os.environ, GIT_DIR=filtered)
+    key = module_data['data_git_hash']+' '+module_data['dir']
+    if os.path.exists(filtered):
+        config = git_repo(env).config
+        if 'pythondata.filtered' in config and config['pythondata.filtered'] == key:
+            return filtered
+    else:
+        subprocess_check_call(['git', 'init', '-q', '--bare', filtered])
+
+    # filter-repo only exports named refs, so point one at the commit.
+    git_repo({'GIT_DIR': src_local}).references.create(
+        HISTORY_REF, module_data['data_git_hash'], force=True)
+    subprocess_check_call([
+        'git', 'filter-repo',
+        '--source', src_local, '--target', filtered,
+        '--to-subdirectory-filter', module_data['dir'],
+        '--refs', HISTORY_REF,
+    ])
+    git_repo(env).config['pythondata.filtered'] = key
+    return filtered
+
+
+def git_has_staged_changes(repo_dir):
+    # `git diff --quiet` stops at the first difference and reports the
+    # result in its exit code, so there is no output to produce or parse.
+    r = subprocess.call(['git', 'diff', '--cached', '--quiet'], cwd=repo_dir)
+    if r not in (0, 1):
+        raise subprocess.CalledProcessError(r, 'git diff --cached --quiet')
+    return r == 1
 
 
 def u(n, dst, src):
     print("{:>10s} {:60s} from {}".format(n, dst, src))
 
 
+LICENSE_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'pythondata-cpu-myooo', 'licenses')
 _license_data = {}
+_license_conn = None
+def license_fetch(path):
+    """Fetch a file from raw.githubusercontent.com.
+
+    One keep-alive connection is reused for all fetches, reconnecting
+    once if the server has closed it in the meantime.
+    """
+    global _license_conn
+    for attempt in range(2):
+        if _license_conn is None:
+            _license_conn = http.client.HTTPSConnection('raw.githubusercontent.com')
+        try:
+            _license_conn.request('GET', path)
+            r = _license_conn.getresponse()
+            data = r.read()
+            break
+        except (http.client.HTTPException, OSError):
+            _license_conn.close()
+            _license_conn = None
+            if attempt:
+                raise
+    assert r.status == 200, (path, r.status, r.reason)
+    return data
+
+
 def get_license(module_data):
     try:
         spdx = module_data['license_spdx']
     except KeyError as e:
         print(module_data)
         raise
-    if spdx not in _license_data:
-        license_url = "https://raw.githubusercontent.com/spdx/license-list-data/master/text/{}.txt".format(spdx)
-        f = urllib.request.urlopen(license_url)
-        assert f.reason == 'OK', f.reason
-        _license_data[spdx] = f.read().decode('utf-8')
+    if spdx in _license_data:
+        return _license_data[spdx]
+
+    # License texts are also cached on disk so they are shared between
+    # worker processes and later runs.
+    cache_file = os.path.join(LICENSE_CACHE_DIR, spdx+'.txt')
+    if os.path.exists(cache_file):
+        with open(cache_file, encoding='utf-8') as f:
+            _license_data[spdx] = f.read()
+        return _license_data[spdx]
+
+    license_path = "/spdx/license-list-data/master/text/{}.txt".format(spdx)
+    _license_data[spdx] = license_fetch(license_path).decode('utf-8')
+
+    os.makedirs(LICENSE_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=LICENSE_CACHE_DIR, delete=False) as f:
+        f.write(_license_data[spdx])
+    os.replace(f.name, cache_file)
     return _license_data[spdx]
 
 
@@ -344,6 +530,17 @@ def update(module_data):
 
     top_dir = os.path.abspath('.')
     template_dir = os.path.abspath(os.path.join(top_dir, "templates"))
+    to_add = []
+
+    # Render keys are kept inside the .git directory so they never show
+    # up in the generated repository.
+    render_cache_file = os.path.join(repo_dir, '.git', 'update_cache.json')
+    try:
+        with open(render_cache_file) as f:
+            render_cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        render_cache = {}
+
     for root, dirs, files in os.walk(template_dir, topdown=True):
         path = os.path.join(template_dir, root)
         repo_root = repo_path(module_data, path, template_dir)
@@ -351,16 +548,18 @@ def update(module_data):
         if not os.path.exists(repo_root):
             os.makedirs(repo_root)
 
+        # Entries are mapped relative to the already resolved directory,
+        # rather than resolving the full template path for each one.
         for d in dirs:
             path_d = os.path.join(path, d)
-            repo_d = repo_path(module_data, path_d, template_dir)
+            repo_d = os.path.join(repo_root, repo_path_bit(module_data, d))
             u("Creating", repo_d, path_d)
             if not os.path.exists(repo_d):
                 os.makedirs(repo_d)
 
         for f in files:
             path_f = os.path.join(path, f)
-            repo_f = repo_path(module_data, path_f, template_dir)
+            repo_f = os.path.join(repo_root, repo_path_bit(module_data, f))
 
             fbase, ext = os.path.splitext(f)
             if ext in ('.swp', '.swo'):
@@ -368,26 +567,33 @@ def update(module_data):
 
             if ext in ('.jinja',):
                 repo_f = repo_f[:-6]
-                u("Rendering", repo_f, path_f)
-                render(module_data, path_f, repo_f)
+                if render_cached(render_cache, module_data, path_f, repo_f):
+                    u("Rendering", repo_f, path_f)
+                else:
+                    u("Unchanged", repo_f, path_f)
+            elif os.path.exists(repo_f) and filecmp.cmp(path_f, repo_f):
+                u("Unchanged", repo_f, path_f)
             else:
                 u("Copying", repo_f, path_f)
                 shutil.copy(path_f, repo_f)
-            git_add_file(module_data, repo_f)
+            to_add.append(repo_f)
+
+    license_file = os.path.join(repo_dir, 'LICENSE')
+    if not os.path.exists(license_file):
+        u("Creating", repo_path(module_data, 'LICENSE', template_dir), module_data['license_spdx'])
+        with open(license_file, 'w') as f:
+            f.write(get_license(module_data))
+    to_add.append(license_file)
+
+    git_add_files(module_data, to_add)
 
-        license_file = os.path.join(repo_dir, 'LICENSE')
-        if not os.path.exists(license_file):
-            u("Creating", repo_path(module_data, 'LICENSE', template_dir), module_data['license_spdx'])
-            with open(license_file, 'w') as f:
-                f.write(get_license(module_data))
-        git_add_file(module_data, license_file)
+    with open(render_cache_file, 'w') as f:
+        json.dump(render_cache, f, indent=2, sort_keys=True)
 
     print('-'*75)
 
     # Commit the changes
-    tocommit = subprocess.check_output(
-        ['git', 'status', '--porcelain'], cwd=repo_dir).decode('utf-8')
-    if tocommit:
+    if git_has_staged_changes(repo_dir):
         with tempfile.NamedTemporaryFile() as f:
 
             git_msg_out = []
@@ -428,10 +634,8 @@ Updated using {tool_version} from https://github.com/litex-hub/litex-data-auto
             print(cmd)
             subprocess_check_call(cmd.split(), cwd=repo_dir)
             # submodule bump does not commit by itself
-            tocommit = subprocess.check_output(
-                ['git', 'status', '--porcelain'], cwd=repo_dir).decode('utf-8')
-            if tocommit:
-                subprocess_check_call(['git', 'add', '.'], cwd=repo_dir)
+            subprocess_check_call(['git', 'add', '.'], cwd=repo_dir)
+            if git_has_staged_changes(repo_dir):
                 with tempfile.NamedTemporaryFile() as f:
                     f.write("""\
 Bump {dir} submodule to {data_git_hash}
@@ -442,17 +646,52 @@ Updated using {tool_version} from https://github.com/litex-hub/litex-data-auto
                     subprocess_check_call(['git', 'commit', '-F', f.name], cwd=repo_dir)
 
         else:
-            if os.path.exists(os.path.join(repo_dir, module_data['dir'])):
-                subtree_cmd = 'pull'
+            if module_data.getboolean('history'):
+                # Merge the upstream history, rewritten to live under the
+                # data directory, so `git log` on it keeps working.
+                filtered = filter_history(module_data)
+                cmd = ['git', 'fetch', filtered, HISTORY_REF]
+                print(cmd)
+                subprocess_check_call(cmd, cwd=repo_dir)
+                subprocess_check_call(
+                    ['git', 'merge', '--no-commit', '--allow-unrelated-histories',
+                     '-s', 'ours', 'FETCH_HEAD'],
+                    cwd=repo_dir)
+                data_tree = 'FETCH_HEAD:'+module_data['dir']
             else:
-                subtree_cmd = 'add'
-            cmd = [
-                'git', 'subtree', subtree_cmd,
-                '-P', module_data['dir'],
-                module_data['src_local'], module_data['data_git_hash'],
-            ]
-            print(cmd)
-            subprocess_check_call(cmd, cwd=repo_dir)
+                # Replace the data directory with the tree at data_git_hash
+                # in one step, rather than having `git subtree` split and
+                # replay the upstream history commit by commit.
+                cmd = [
+                    'git', 'fetch', '--depth=1',
+                    module_data['src_local'], module_data['data_git_hash'],
+                ]
+                print(cmd)
+                subprocess_check_call(cmd, cwd=repo_dir)
+                data_tree = 'FETCH_HEAD'
+
+            if os.path.exists(data_dir):
+                subprocess_check_call(
+                    ['git', 'rm', '-r', '-q', '--cached', '--ignore-unmatch',
+                     module_data['dir']],
+                    cwd=repo_dir)
+                shutil.rmtree(data_dir)
+            subprocess_check_call(
+                ['git', 'read-tree',
+                 '--prefix='+module_data['dir']+'/', '-u', data_tree],
+                cwd=repo_dir)
+            merging = os.path.exists(os.path.join(repo_dir, '.git', 'MERGE_HEAD'))
+            if merging or git_has_staged_changes(repo_dir):
+                with tempfile.NamedTemporaryFile() as f:
+                    f.write("""\
+Updating {dir} to {data_git_describe}
+
+Updated data to {data_git_describe} based on {data_git_hash} from {src}.
+
+Updated using {tool_version} from https://github.com/litex-hub/litex-data-auto
+""".format(**module_data).encode('utf-8'))
+                    f.flush()
+                    subprocess_check_call(['git', 'commit', '-F', f.name], cwd=repo_dir)
 
             gitmodules = os.path.join(data_dir, ".gitmodules")
             if os.path.exists(gitmodules):
@@ -581,10 +820,77 @@ def end_module_output(module):
     sys.stderr.flush()
 
 
+def update_module(module, module_data, tool_version_vdesc):
+    """Fetch the source data for a module and update its repository.
+
+    Runs in a worker process. The module data is passed as a plain dict
+    (config sections can not be pickled) and returned with the values
+    filled in, together with everything written to stdout / stderr so
+    the caller can print the log of each module in one piece.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({module: module_data})
+    m = config[module]
+
+    error = None
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    with tempfile.TemporaryFile(mode='w+', errors='replace') as log:
+        # Redirect at the file descriptor level so the output of git and
+        # other child processes is captured too.
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            start_module_output(module)
+            if 'src' in m:
+                get_src(m)
+            else:
+                assert 'git_describe' in m, m
+                assert 'git_hash' in m, m
+                m['data_git_describe'] = m['git_describe']
+                del m['git_describe']
+                m['data_git_hash'] = m['git_hash']
+                del m['git_hash']
+
+                versions = parse_tags(m['data_git_describe'])
+                assert len(versions) == 1, "Got multiple versions from " + m['data_git_describe']
+                vdesc, t = versions[0]
+                m['data_version_tuple'] = repr(tuple(vdesc.release))
+                m['data_version'] = str(vdesc)
+
+            module_version = version_join(tool_version_vdesc, version.Version(m['data_version']))
+            m['version'] = str(module_version)
+            m['version_tuple'] = repr(version_tuple(module_version))
+
+            module_output(module, list(m.items()))
+            print(module, m['version'], m['version_tuple'])
+            print('Tools:', m['tool_version'], m['tool_version_tuple'])
+            print(' Data:', m['data_version'], m['data_version_tuple'])
+            download(m)
+            update(m)
+
+            end_module_output(module)
+        except Exception as e:
+            traceback.print_exc()
+            error = e
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+        log.seek(0)
+        output = log.read()
+    return dict(m), output, error
+
+
 def main(name, argv):
     should_push = "--push" in argv
     if should_push:
         argv.remove("--push")
+    only = set(argv)
 
     token = os.environ.get('GH_TOKEN', None)
     if token:
@@ -600,12 +906,11 @@ def main(name, argv):
 
     config = configparser.ConfigParser(interpolation=None)
     config.read('modules.ini')
+    modules = []
     for module in config.sections():
-        if argv and module not in argv:
+        if only and module not in only:
             continue
 
-        start_module_output(module)
-
         m = config[module]
 
         repo_name = 'pythondata-{t}-{mod}'.format(
@@ -622,44 +927,34 @@ def main(name, argv):
             repo=repo_name)
         m['py'] = 'pythondata_{type}_{name}'.format(type=m['type'], name=module)
         m['dir'] = os.path.join(m['py'], m['contents'])
-        if 'src' in m:
-            get_src(m)
-        else:
-            assert 'git_describe' in m, m
-            assert 'git_hash' in m, m
-            m['data_git_describe'] = m['git_describe']
-            del m['git_describe']
-            m['data_git_hash'] = m['git_hash']
-            del m['git_hash']
-
-            versions = parse_tags(m['data_git_describe'])
-            assert len(versions) == 1, "Got multiple versions from " + m['data_git_describe']
-            vdesc, t = versions[0]
-            m['data_version_tuple'] = repr(tuple(vdesc.release))
-            m['data_version'] = str(vdesc)
-
-        module_version = version_join(tool_version_vdesc, version.Version(m['data_version']))
-        m['version'] = str(module_version)
-        m['version_tuple'] = repr(version_tuple(module_version))
-
-        module_output(module, list(m.items()))
-        print(module, m['version'], m['version_tuple'])
-        print('Tools:', tool_version, tool_version_tuple)
-        print(' Data:', m['data_version'], m['data_version_tuple'])
+
         if not github_repo(g, m):
             print("No github repo:", repo_name)
             continue
-        download(m)
-        update(m)
-
-        end_module_output(module)
+        modules.append((module, dict(m)))
+
+    # Modules are independent of each other, so fetch and update them in
+    # parallel. Logs are printed in config order as each one completes.
+    updated = []
+    if modules:
+        jobs = min(MAX_JOBS, len(modules))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex:
+            futures = [
+                (module, ex.submit(update_module, module, m, tool_version_vdesc))
+                for module, m in modules]
+            for module, future in futures:
+                m, output, error = future.result()
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                if error is not None:
+                    for _, f in futures:
+                        f.cancel()
+                    raise error
+                updated.append((module, m))
 
     if should_push:
         assert g.token
-        for module in config.sections():
-            if argv and module not in argv:
-                continue
-            m = config[module]
+        for module, m in updated:
             start_module_output(module)
             github_repo(g, m)
             module_output(module, m)
@@ -670,8 +965,11 @@ def main(name, argv):
 
 
 if __name__ == "__main__":
-    import doctest
-    failure_count, test_count = doctest.testmod()
-    if failure_count > 0:
-        sys.exit(-1)
+    # Doctests are run by `make test`, set RUN_DOCTESTS=1 to also run them
+    # before updating.
+    if os.environ.get('RUN_DOCTESTS'):
+        import doctest
+        failure_count, test_count = doctest.testmod()
+        if failure_count > 0:
+            sys.exit(-1)
     sys.exit(main(sys.argv[0], sys.argv[1:]))